@@ -1,82 +1,46 @@
+import argparse
 import datetime
 import pandas as pd
-from gpt4all import GPT4All
 import json
 import math
+import numpy as np
+from data_loader import DatasetReader
+from pipeline_planner import PROMPT_VERSION as PLANNER_PROMPT_VERSION, PipelinePlanner
+from model_loader import MODEL_NAME, load_model_async, resolve_model
+from stage_cache import StageCache, column_hashes, file_hash
 
-class DataClassifier:
-    def __init__(self):
-        self.__model = GPT4All("Meta-Llama-3-8B-Instruct.Q4_0.gguf", model_path='./', allow_download=False, n_ctx=8192)
-
-    def classify_dataset(self, df):
-        columns = df.columns.tolist()
-        sample_data = df.sample(min(5, len(df)), random_state=42).to_dict(orient="records")
-
-        prompt = f"""
-        Classify the following dataset based on its content:
-        - Financial Data (transactions, account balances, revenues, invoices)
-        - Customer Data (names, emails, phone numbers, addresses)
-        - Other Data (if it doesn’t fit the above)
-
-        Dataset details:
-        Columns: {columns}
-        Sample Data: {sample_data}
-
-        Return only the category name.
-        """
-
-        response = self.__model.generate(prompt)
-        return response.strip()
-
-
-class FinancialDataPreprocessor:
-    def __init__(self):
-        self.__columns = []
-        self.__model = GPT4All("Meta-Llama-3-8B-Instruct.Q4_0.gguf", model_path='./', allow_download=False, n_ctx=8192)
-        self.__base_prompt = '''
-        Given dataset headers and one row, identify financial columns to keep while discarding:
-        - IDs (e.g., transaction IDs, CUSIP)
-        - Binary columns (Yes/No, Y/N)
-        - Redundant or irrelevant fields
-
-        Keep columns containing:
-        - Dates and timestamps
-        - Monetary values
-        - Descriptions of financial transactions
-
-        Return a JSON list of relevant column names.
-        '''
-
-    def preprocess_data(self, df):
-        column_names = json.dumps(df.columns.tolist(), indent=4)
-        row = json.dumps(df.sample(1, random_state=42).values.tolist()[0], indent=4)
-
-        prompt = f"{self.__base_prompt}\nColumns: {column_names}\nSample Row: {row}\n"
-        
-        with self.__model.chat_session():
-            response = self.__model.generate(prompt, max_tokens=512)
-        
-        try:
-            retained_columns = json.loads(response)
-            if isinstance(retained_columns, list):
-                return df[retained_columns]
-        except json.JSONDecodeError:
-            return df  # Fallback: return original data if parsing fails
-
+# Bump whenever the generation prompt changes so cached rows are not reused
+GENERATION_PROMPT_VERSION = 2
 
 class FinancialSyntheticDataGenerator:
-    def __init__(self, input_df, n_synthetic_rows=10):
-        self.__model = GPT4All("Meta-Llama-3-8B-Instruct.Q4_0.gguf", model_path='./', allow_download=False, n_ctx=8192)
+    def __init__(self, input_df, n_synthetic_rows=10, model=None, column_strategies=None, bucket_size=None, stage_cache=None):
+        # Resolved on first use, so a fully cached run never waits for the model
+        self.__model_source = model
+        self.__model = None
+        self.__stage_cache = stage_cache
         self.__input_df = input_df
         self.__n_synthetic_rows = n_synthetic_rows
+        self.__bucket_size = bucket_size or n_synthetic_rows
+        # Columns planned as "sample" are drawn from observed values instead of being written by the model
+        column_strategies = column_strategies or {}
+        self.__llm_columns = [col for col in input_df.columns if column_strategies.get(col, "llm") == "llm"]
+        self.__sampled_columns = [col for col in input_df.columns if col not in self.__llm_columns]
         self.generated_df = None
 
-    def generate_synthetic_data(self):
-        column_names = json.dumps(self.__input_df.columns.tolist(), indent=4)
-        sample_data = json.dumps(self.__input_df.sample(5, random_state=42).values.tolist(), indent=4)
+    def __example_rows(self):
+        """ The 5 llm-column rows with the smallest content hashes, which appended rows rarely displace. """
+        # A random sample changes whenever a row is added; these examples (and so the cached rows) mostly don't
+        sample_df = self.__input_df[self.__llm_columns]
+        hashes = pd.util.hash_pandas_object(sample_df, index=False).to_numpy()
+        return sample_df.iloc[np.argsort(hashes, kind="stable")[:5]]
+
+    def __generate_llm_rows(self, n_rows):
+        column_names = json.dumps(self.__llm_columns, indent=4)
+        sample_df = self.__input_df[self.__llm_columns]
+        sample_data = json.dumps(self.__example_rows().values.tolist(), indent=4, default=str)
 
         prompt = f"""
-        Generate {self.__n_synthetic_rows} new rows of financial data.
+        Generate {n_rows} new rows of financial data.
         - Ensure values are **not present** in the original dataset.
         - Retain the **format, meaning, and patterns** of existing data.
 
@@ -86,15 +50,53 @@ class FinancialSyntheticDataGenerator:
         Return only the new rows in JSON format.
         """
 
+        if self.__model is None:
+            self.__model = resolve_model(self.__model_source)
+
         with self.__model.chat_session():
-            response = self.__model.generate(prompt, max_tokens=self.__n_synthetic_rows * 1024)
+            response = self.__model.generate(prompt, max_tokens=n_rows * 1024)
 
         try:
             synthetic_rows = json.loads(response)
             if isinstance(synthetic_rows, list):
-                self.generated_df = pd.DataFrame(synthetic_rows, columns=self.__input_df.columns)
+                return pd.DataFrame(synthetic_rows, columns=self.__llm_columns)
         except json.JSONDecodeError:
-            self.generated_df = self.__input_df.sample(self.__n_synthetic_rows, replace=True)  # Fallback
+            pass
+        return sample_df.sample(n_rows, replace=True).reset_index(drop=True)  # Fallback
+
+    def __generate_llm_part(self):
+        batches = []
+        n_remaining_rows = self.__n_synthetic_rows
+        while n_remaining_rows > 0:
+            n_rows = min(n_remaining_rows, self.__bucket_size)
+            batches.append(self.__generate_llm_rows(n_rows))
+            n_remaining_rows -= n_rows
+        return pd.concat(batches, ignore_index=True)
+
+    def generate_synthetic_data(self):
+        if not self.__llm_columns:
+            generated_df = pd.DataFrame(index=range(self.__n_synthetic_rows))
+        elif self.__stage_cache is None:
+            generated_df = self.__generate_llm_part()
+        else:
+            # Model-written rows only depend on the llm column names and the example rows in the prompt,
+            # so appended rows or changes to other columns don't force regeneration
+            inputs = {
+                "columns": [str(col) for col in self.__llm_columns],
+                "examples": column_hashes(self.__example_rows()),
+                "n_synthetic_rows": self.__n_synthetic_rows,
+                "bucket_size": self.__bucket_size,
+                "prompt_version": GENERATION_PROMPT_VERSION,
+                "model": MODEL_NAME,
+            }
+            generated_df = self.__stage_cache.run("generate", inputs, self.__generate_llm_part)
+
+        # Sampled columns are cheap, so they are redrawn from the current data on every run
+        for col in self.__sampled_columns:
+            observed = self.__input_df[col].dropna()
+            generated_df[col] = observed.sample(len(generated_df), replace=True).values if not observed.empty else None
+
+        self.generated_df = generated_df[self.__input_df.columns]
 
 
 def save_dataframe_to_excel(df):
@@ -105,20 +107,69 @@ def save_dataframe_to_excel(df):
 
 
 def main():
-    df = pd.read_excel("Dataset.xlsx", sheet_name="Sheet1")
-
-    classifier = DataClassifier()
-    dataset_type = classifier.classify_dataset(df)
-    print(f"Dataset Type: {dataset_type}")
-
-    if "Financial" not in dataset_type:
+    parser = argparse.ArgumentParser(description="Generate synthetic financial data from a workbook.")
+    parser.add_argument("--input", default="Dataset.xlsx")
+    parser.add_argument("--sheet", default="Sheet1")
+    parser.add_argument("--rows", type=int, default=10)
+    args = parser.parse_args()
+
+    # Every stage records a hash of its inputs, so unchanged stages are reused on re-runs
+    cache = StageCache()
+    source_hash = file_hash(args.input)
+    reader = DatasetReader(args.input, sheet_name=args.sheet, sample_size=10)
+
+    # A single model serves both the planner and the generator; it is only loaded if a stage has to run
+    model_futures = []
+
+    def model_future():
+        if not model_futures:
+            model_futures.append(load_model_async())
+        return model_futures[0]
+
+    def load_stage():
+        # The weights load in the background while the workbook is streamed and profiled
+        model_future()
+        sample_df = reader.scan()
+        return {"sample_df": sample_df, "column_profiles": reader.column_profiles}
+
+    loaded = cache.run("load", {"source": source_hash, "sheet": args.sheet, "sample_size": 10}, load_stage)
+
+    # Planning depends on the schema, which columns are empty and roughly how many distinct values each has.
+    # Distinct counts are bucketed by powers of two so appended rows only replan when a column's shape changes.
+    plan_inputs = {
+        "columns": [str(col) for col in loaded["sample_df"].columns],
+        "profiles": {
+            str(col): {
+                "empty": profile["non_null"] == 0,
+                "distinct_bucket": None if profile["n_distinct"] is None else profile["n_distinct"].bit_length(),
+            }
+            for col, profile in loaded["column_profiles"].items()
+        },
+        "prompt_version": PLANNER_PROMPT_VERSION,
+        "model": MODEL_NAME,
+    }
+    plan = cache.run(
+        "plan",
+        plan_inputs,
+        lambda: PipelinePlanner(model=model_future()).plan(loaded["sample_df"], column_profiles=loaded["column_profiles"]),
+    )
+    print(f"Dataset Type: {plan['category']}")
+
+    if "Financial" not in plan["category"]:
         print("Dataset is not financial. Exiting.")
         return
 
-    processor = FinancialDataPreprocessor()
-    processed_df = processor.preprocess_data(df)
-
-    generator = FinancialSyntheticDataGenerator(processed_df, n_synthetic_rows=10)
+    condense_inputs = {"source": source_hash, "sheet": args.sheet, "keep_columns": plan["keep_columns"]}
+    processed_df = cache.run("condense", condense_inputs, lambda: reader.read_columns(plan["keep_columns"]))
+
+    generator = FinancialSyntheticDataGenerator(
+        processed_df,
+        n_synthetic_rows=args.rows,
+        model=model_future,
+        column_strategies=plan["column_strategies"],
+        bucket_size=plan["bucket_size"],
+        stage_cache=cache,
+    )
     generator.generate_synthetic_data()
 
     synthetic_df = generator.generated_df
@@ -20,8 +20,12 @@ with DAG(
         echo "🚀 Starting Cloud SQL Proxy..."
         /tmp/cloud_sql_proxy -instances={{ var.value.INSTANCE_CONNECTION_NAME }}=tcp:5432 &
 
-        echo "⏳ Waiting for proxy to initialize..."
-        sleep 10
+        echo "⏳ Waiting for proxy to accept connections..."
+        for attempt in $(seq 1 60); do
+            pg_isready -h 127.0.0.1 -p 5432 -q && break
+            sleep 1
+        done
+        pg_isready -h 127.0.0.1 -p 5432 || { echo "❌ Proxy did not become ready."; exit 1; }
 
         echo "🔗 Connecting to DB via Proxy..."
         PGPASSWORD={{ var.value.DB_PASSWORD }} \
@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+
+NAT = np.iinfo(np.int64).min
+
+
+class _IntegerColumn:
+    def __init__(self, capacity):
+        self.values = np.empty(capacity, dtype=np.int64)
+        self.mask = np.empty(capacity, dtype=bool)
+
+    def grow(self, capacity):
+        values = np.empty(capacity, dtype=np.int64)
+        mask = np.empty(capacity, dtype=bool)
+        values[:len(self.values)] = self.values
+        mask[:len(self.mask)] = self.mask
+        self.values, self.mask = values, mask
+
+    def parse(self, value):
+        """ Returns the int for value (None when missing), or raises ValueError if it isn't a whole number. """
+        if value is None or value == "":
+            return None
+        if isinstance(value, str):
+            value = value.replace(",", "")
+        number = float(value)
+        if not number.is_integer() or not NAT <= number < -NAT:
+            raise ValueError(f"{value!r} is not a whole number that fits in int64")
+        return int(number)
+
+    def set(self, row, parsed):
+        self.mask[row] = parsed is None
+        self.values[row] = 0 if parsed is None else parsed
+
+    def value(self, row):
+        return None if self.mask[row] else int(self.values[row])
+
+    def to_series(self, start, end, name):
+        # Nullable Int64, so whole numbers stay whole even when the model leaves some cells empty
+        return pd.Series(pd.arrays.IntegerArray(self.values[start:end], self.mask[start:end]), name=name, copy=False)
+
+
+class _NumericColumn:
+    def __init__(self, capacity):
+        self.values = np.empty(capacity, dtype=np.float64)
+
+    def grow(self, capacity):
+        values = np.empty(capacity, dtype=np.float64)
+        values[:len(self.values)] = self.values
+        self.values = values
+
+    def parse(self, value):
+        """ Returns the float for value, or raises ValueError if it isn't numeric. """
+        if value is None or value == "":
+            return np.nan
+        if isinstance(value, str):
+            value = value.replace(",", "")
+        return float(value)
+
+    def set(self, row, parsed):
+        self.values[row] = parsed
+
+    def value(self, row):
+        return None if np.isnan(self.values[row]) else float(self.values[row])
+
+    def to_series(self, start, end, name):
+        return pd.Series(self.values[start:end], name=name, copy=False)
+
+
+class _DatetimeColumn:
+    def __init__(self, capacity):
+        # Nanoseconds since the epoch, the same layout as datetime64[ns]; NAT marks a missing value
+        self.values = np.empty(capacity, dtype=np.int64)
+
+    def grow(self, capacity):
+        values = np.empty(capacity, dtype=np.int64)
+        values[:len(self.values)] = self.values
+        self.values = values
+
+    def parse(self, value):
+        if value is None or value == "":
+            return NAT
+        timestamp = pd.Timestamp(value)
+        if timestamp is pd.NaT:
+            return NAT
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert(None)
+        return timestamp.value
+
+    def set(self, row, parsed):
+        self.values[row] = parsed
+
+    def value(self, row):
+        return None if self.values[row] == NAT else pd.Timestamp(self.values[row]).isoformat()
+
+    def to_series(self, start, end, name):
+        return pd.Series(self.values[start:end].view("datetime64[ns]"), name=name, copy=False)
+
+
+class _DictionaryColumn:
+    def __init__(self, capacity):
+        # Each distinct value is stored once; rows hold an int32 code into it (-1 is missing)
+        self.codes = np.empty(capacity, dtype=np.int32)
+        self.categories = []
+        self.__lookup = {}
+
+    def grow(self, capacity):
+        codes = np.empty(capacity, dtype=np.int32)
+        codes[:len(self.codes)] = self.codes
+        self.codes = codes
+
+    def parse(self, value):
+        if value is None:
+            return -1
+        value = str(value)
+        code = self.__lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.__lookup[value] = code
+            self.categories.append(value)
+        return code
+
+    def set(self, row, parsed):
+        self.codes[row] = parsed
+
+    def value(self, row):
+        return None if self.codes[row] == -1 else self.categories[self.codes[row]]
+
+    def to_series(self, start, end, name):
+        # Only the categories this slice uses, so a flushed batch doesn't carry every value seen so far
+        codes = self.codes[start:end]
+        used = np.unique(codes[codes >= 0])
+        local_codes = np.where(codes >= 0, np.searchsorted(used, codes), -1).astype(np.int32)
+        return pd.Series(pd.Categorical.from_codes(local_codes, [self.categories[code] for code in used]), name=name)
+
+
+class _TextColumn:
+    def __init__(self, capacity):
+        # Mostly-unique text such as descriptions: a dictionary would store every value twice for no saving
+        self.values = np.empty(capacity, dtype=object)
+
+    def grow(self, capacity):
+        values = np.empty(capacity, dtype=object)
+        values[:len(self.values)] = self.values
+        self.values = values
+
+    def parse(self, value):
+        return None if value is None else str(value)
+
+    def set(self, row, parsed):
+        self.values[row] = parsed
+
+    def value(self, row):
+        return self.values[row]
+
+    def to_series(self, start, end, name):
+        return pd.Series(self.values[start:end], name=name, dtype=object, copy=False)
+
+
+# Where a column goes when the model writes a value its buffer can't hold
+_FALLBACK_COLUMN = {
+    _IntegerColumn: _NumericColumn,
+    _NumericColumn: _DictionaryColumn,
+    _DatetimeColumn: _DictionaryColumn,
+}
+
+
+def _column_for_dtype(dtype, capacity):
+    if dtype is None or pd.api.types.is_bool_dtype(dtype):
+        return _DictionaryColumn(capacity)
+    if pd.api.types.is_integer_dtype(dtype):
+        return _IntegerColumn(capacity)
+    if pd.api.types.is_numeric_dtype(dtype):
+        return _NumericColumn(capacity)
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return _DatetimeColumn(capacity)
+    return _DictionaryColumn(capacity)
+
+
+class ColumnarRowBuilder:
+    def __init__(self, columns, dtypes=None, initial_capacity=1024, dictionary_ratio=0.5, min_rows_for_ratio=64):
+        """ columns: output column names; dtypes: optional source dtypes, which pick each column's buffer type.
+
+        Text columns start dictionary-encoded and become plain object columns once they have seen at least
+        min_rows_for_ratio rows and more than dictionary_ratio distinct values per row.
+        """
+        self.columns = list(columns)
+        self.__dictionary_ratio = dictionary_ratio
+        self.__min_rows_for_ratio = min_rows_for_ratio
+        self.n_rows = 0
+        self.__flushed_rows = 0
+        self.__capacity = initial_capacity
+        self.__columns = []
+        for col in self.columns:
+            dtype = dtypes[col] if dtypes is not None and col in dtypes else None
+            self.__columns.append(_column_for_dtype(dtype, initial_capacity))
+
+    def __ensure_capacity(self, n_rows):
+        if n_rows <= self.__capacity:
+            return
+        # Double the buffers so appends stay amortised O(1) per row
+        while self.__capacity < n_rows:
+            self.__capacity *= 2
+        for column in self.__columns:
+            column.grow(self.__capacity)
+
+    def __demote(self, index):
+        """ Moves a column to its fallback buffer (int -> float -> dictionary, datetime -> dictionary). """
+        column = self.__columns[index]
+        fallback = _FALLBACK_COLUMN[type(column)](self.__capacity)
+        for row in range(self.n_rows):
+            fallback.set(row, fallback.parse(column.value(row)))
+        self.__columns[index] = fallback
+
+    def __drop_high_cardinality_dictionaries(self):
+        if self.n_rows < self.__min_rows_for_ratio:
+            return
+        for index, column in enumerate(self.__columns):
+            if isinstance(column, _DictionaryColumn) and len(column.categories) > self.__dictionary_ratio * self.n_rows:
+                text = _TextColumn(self.__capacity)
+                for row in range(self.n_rows):
+                    text.set(row, column.value(row))
+                self.__columns[index] = text
+
+    def append_rows(self, rows):
+        """ Appends a parsed batch (a list of row lists, in column order) without keeping the Python objects. """
+        for row in rows:
+            if len(row) != len(self.columns):
+                raise ValueError(f"{len(self.columns)} columns passed, passed data had {len(row)} columns")
+
+        self.__ensure_capacity(self.n_rows + len(rows))
+        for index in range(len(self.columns)):
+            column = self.__columns[index]
+            for offset, row in enumerate(rows):
+                while True:
+                    try:
+                        parsed = column.parse(row[index])
+                        break
+                    except (TypeError, ValueError, OverflowError):
+                        self.__demote(index)
+                        column = self.__columns[index]
+                        # Re-parse the rows of this batch already written to the old buffer
+                        for earlier, earlier_row in enumerate(rows[:offset]):
+                            column.set(self.n_rows + earlier, column.parse(earlier_row[index]))
+                column.set(self.n_rows + offset, parsed)
+        self.n_rows += len(rows)
+        self.__drop_high_cardinality_dictionaries()
+
+    def to_frame(self, start=0, end=None):
+        """ DataFrame over the buffered rows; numeric, datetime and text columns are views of the buffers, not copies. """
+        end = self.n_rows if end is None else end
+        if not self.columns:
+            return pd.DataFrame(index=range(end - start))
+        series = [column.to_series(start, end, name) for column, name in zip(self.__columns, self.columns)]
+        # A dict with copy=False keeps one block per column instead of consolidating them into a copy
+        return pd.DataFrame(dict(zip(self.columns, series)), columns=self.columns, copy=False)
+
+    def to_arrow(self, start=0, end=None):
+        """ Arrow table over the buffered rows; dictionary columns become Arrow dictionary arrays. """
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(self.to_frame(start, end), preserve_index=False)
+
+    def flush(self, writer, chunk_size=None):
+        """ Hands every full chunk of unflushed rows (or all of them if chunk_size is None) to writer(frame). """
+        chunk_size = chunk_size or max(1, self.n_rows - self.__flushed_rows)
+        while self.n_rows - self.__flushed_rows >= chunk_size:
+            writer(self.to_frame(self.__flushed_rows, self.__flushed_rows + chunk_size))
+            self.__flushed_rows += chunk_size
@@ -1,11 +1,14 @@
 import datetime
-import pandas as pd
 import re
+from data_loader import DatasetReader
 
 class CondenseDataset:
-    def __init__(self, input_df, sample_size=10):
+    def __init__(self, input_df, sample_size=10, empty_columns=None):
         self.__input_df = input_df
         self.sample_size = min(sample_size, len(input_df))  # Limit sample size
+        # When input_df is only a sample, the caller passes the columns known to be empty in the full dataset
+        self.__empty_columns = empty_columns
+        self.kept_columns = []
         self.condensed_df = None
 
     def preprocess_data(self):
@@ -16,7 +19,10 @@ class CondenseDataset:
         sample_df = df_cleaned.sample(self.sample_size, random_state=42)
 
         # Drop columns that are completely empty
-        df_cleaned = df_cleaned.dropna(axis=1, how='all')
+        if self.__empty_columns is None:
+            df_cleaned = df_cleaned.dropna(axis=1, how='all')
+        else:
+            df_cleaned = df_cleaned.drop(columns=self.__empty_columns)
 
         def is_primary_key(col):
             """ Identifies if a column is an ID or a primary key based on sample analysis. """
@@ -37,6 +43,7 @@ class CondenseDataset:
         kept_columns = [col for col in df_cleaned.columns if col not in remove_columns]
 
         # Save the condensed DataFrame
+        self.kept_columns = kept_columns
         self.condensed_df = df_cleaned[kept_columns]
 
     def save_to_excel(self):
@@ -48,10 +55,13 @@ class CondenseDataset:
 
 def main():
     """ Main function to process and save the condensed dataset. """
-    input_df = pd.read_excel("Dataset.xlsx", sheet_name="Sheet1")
+    # Stream the workbook once for a sample and column profiles, then load only the kept columns
+    reader = DatasetReader("Dataset.xlsx", sheet_name="Sheet1", sample_size=10)
+    sample_df = reader.scan()
 
-    processor = CondenseDataset(input_df=input_df, sample_size=10)
+    processor = CondenseDataset(input_df=sample_df, sample_size=10, empty_columns=reader.empty_columns())
     processor.preprocess_data()
+    processor.condensed_df = reader.read_columns(processor.kept_columns)
     filename = processor.save_to_excel()
 
     print(f"Condensed dataset saved as: {filename}")
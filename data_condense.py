@@ -1,19 +1,22 @@
 import datetime
-import pandas as pd
 import json
-from gpt4all import GPT4All
+from data_loader import DatasetReader
+from model_loader import load_model_async, resolve_model
 
 class CondenseDataset:
     def __init__(self, input_file, sheet_name="Sheet1", model_name="Meta-Llama-3-8B-Instruct.Q4_0.gguf", sample_size=10):
-        self.__model = GPT4All(model_name=model_name, model_path="./", allow_download=False, n_ctx=8192)
+        # Start loading the model in the background so it overlaps with reading the workbook
+        self.__model_source = load_model_async(model_name=model_name)
+        self.__model = None
         self.input_file = input_file
         self.sheet_name = sheet_name
         self.sample_size = sample_size
         self.condensed_df = None
+        self.__reader = DatasetReader(input_file, sheet_name=sheet_name, sample_size=sample_size)
 
     def load_data(self):
-        """ Loads the dataset from an Excel file. """
-        return pd.read_excel(self.input_file, sheet_name=self.sheet_name)
+        """ Streams the Excel file once, returning a sample of rows and profiling every column. """
+        return self.__reader.scan()
 
     def analyze_columns_with_gpt(self, sample_df):
         """ Uses GPT-4All to decide which columns to keep/drop based on sample data patterns. """
@@ -34,6 +37,9 @@ class CondenseDataset:
         Please provide only the JSON response.
         """
 
+        if self.__model is None:
+            self.__model = resolve_model(self.__model_source)
+
         response = None
         with self.__model.chat_session():
             while response is None:
@@ -45,20 +51,17 @@ class CondenseDataset:
 
         return response.get("keep_columns", [])
 
-    def preprocess_data(self, df):
-        """ Extracts sample rows, uses GPT to decide on columns, and removes unnecessary ones. """
-
-        # Drop completely empty columns
-        df_cleaned = df.dropna(axis=1, how='all')
+    def preprocess_data(self, sample_df):
+        """ Uses GPT to decide on columns from the sample rows, then reads only the kept columns of the full dataset. """
 
-        # Take a sample to analyze patterns
-        sample_df = df_cleaned.sample(min(self.sample_size, len(df_cleaned)), random_state=42)
+        # Drop columns that are empty across the whole file, not just in the sample
+        sample_df = sample_df.drop(columns=self.__reader.empty_columns())
 
         # Use GPT4All to analyze and determine columns to keep
-        kept_columns = self.analyze_columns_with_gpt(sample_df)
+        kept_columns = [col for col in self.analyze_columns_with_gpt(sample_df) if col in sample_df.columns]
 
         # Save the condensed DataFrame
-        self.condensed_df = df_cleaned[kept_columns]
+        self.condensed_df = self.__reader.read_columns(kept_columns)
 
     def save_to_excel(self):
         """ Saves the condensed dataset to a new Excel file. """
@@ -0,0 +1,143 @@
+import os
+import random
+import pandas as pd
+
+
+class DatasetReader:
+    def __init__(self, input_file, sheet_name="Sheet1", sample_size=10, chunk_size=50000, random_state=42, distinct_limit=1000):
+        self.input_file = input_file
+        self.sheet_name = sheet_name
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        self.distinct_limit = distinct_limit
+
+        self.columns = []
+        self.n_rows = 0
+        self.sample_df = None
+        self.column_profiles = {}
+
+    def __file_format(self):
+        extension = os.path.splitext(self.input_file)[1].lower()
+        if extension in (".xlsx", ".xlsm"):
+            return "xlsx"
+        if extension in (".csv", ".txt"):
+            return "csv"
+        if extension in (".parquet", ".pq"):
+            return "parquet"
+        raise ValueError(f"Unsupported input format: {extension}")
+
+    def __iter_xlsx_chunks(self, columns=None):
+        """ Streams an Excel sheet in read-only mode, never holding more than one chunk of rows. """
+        from openpyxl import load_workbook
+
+        book = load_workbook(self.input_file, read_only=True, data_only=True)
+        try:
+            rows = book[self.sheet_name].iter_rows(values_only=True)
+            header = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(next(rows, ()))]
+
+            indices = list(range(len(header)))
+            if columns is not None:
+                indices = [header.index(col) for col in columns]
+            names = [header[i] for i in indices]
+
+            chunk = []
+            yielded = False
+            for row in rows:
+                # Read-only sheets can yield short rows when trailing cells are empty
+                chunk.append([row[i] if i < len(row) else None for i in indices])
+                if len(chunk) >= self.chunk_size:
+                    yield pd.DataFrame(chunk, columns=names)
+                    chunk = []
+                    yielded = True
+            if chunk or not yielded:
+                yield pd.DataFrame(chunk, columns=names)
+        finally:
+            book.close()
+
+    def __iter_csv_chunks(self, columns=None):
+        for chunk in pd.read_csv(self.input_file, usecols=columns, chunksize=self.chunk_size):
+            yield chunk if columns is None else chunk[columns]
+
+    def __iter_parquet_chunks(self, columns=None):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(self.input_file)
+        for batch in parquet_file.iter_batches(batch_size=self.chunk_size, columns=columns):
+            yield batch.to_pandas()
+
+    def iter_chunks(self, columns=None):
+        """ Yields the dataset as DataFrames of at most chunk_size rows, optionally restricted to columns. """
+        file_format = self.__file_format()
+        if file_format == "xlsx":
+            return self.__iter_xlsx_chunks(columns)
+        if file_format == "csv":
+            return self.__iter_csv_chunks(columns)
+        return self.__iter_parquet_chunks(columns)
+
+    def __update_profiles(self, chunk):
+        for col in chunk.columns:
+            profile = self.column_profiles.setdefault(col, {
+                "non_null": 0,
+                "distinct_values": set(),
+                "distinct_capped": False,
+                "only_yes_no": True,
+                "max_length": 0,
+            })
+
+            values = chunk[col].dropna()
+            profile["non_null"] += len(values)
+            if values.empty:
+                continue
+
+            text = values.astype(str)
+            profile["max_length"] = max(profile["max_length"], int(text.str.len().max()))
+            if profile["only_yes_no"]:
+                profile["only_yes_no"] = bool(text.str.match(r'^[YNyn]$').all())
+
+            if not profile["distinct_capped"]:
+                profile["distinct_values"].update(text.unique())
+                if len(profile["distinct_values"]) > self.distinct_limit:
+                    profile["distinct_capped"] = True
+                    profile["distinct_values"] = set()
+
+    def scan(self):
+        """ Reads the dataset once, reservoir-sampling exemplar rows and profiling every column. """
+        rng = random.Random(self.random_state)
+        reservoir = []
+        self.n_rows = 0
+        self.column_profiles = {}
+
+        for chunk in self.iter_chunks():
+            self.columns = chunk.columns.tolist()
+            self.__update_profiles(chunk)
+
+            # Algorithm R: row i replaces a random reservoir slot with probability k / (i + 1)
+            for row in chunk.itertuples(index=False, name=None):
+                if len(reservoir) < self.sample_size:
+                    reservoir.append(row)
+                else:
+                    slot = rng.randint(0, self.n_rows)
+                    if slot < self.sample_size:
+                        reservoir[slot] = row
+                self.n_rows += 1
+
+        self.sample_df = pd.DataFrame(reservoir, columns=self.columns)
+
+        for profile in self.column_profiles.values():
+            profile["n_distinct"] = None if profile["distinct_capped"] else len(profile["distinct_values"])
+            del profile["distinct_values"]
+
+        return self.sample_df
+
+    def empty_columns(self):
+        """ Columns with no values anywhere in the dataset. Requires scan() to have run. """
+        return [col for col, profile in self.column_profiles.items() if profile["non_null"] == 0]
+
+    def read_columns(self, columns):
+        """ Materializes the full dataset, but only for the given columns. """
+        columns = list(columns)
+        chunks = list(self.iter_chunks(columns))
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
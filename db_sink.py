@@ -0,0 +1,103 @@
+import io
+import pandas as pd
+
+# pandas dtype kind -> Postgres column type used when the sink creates the target table.
+# Integer source columns map to NUMERIC, since generated values such as "5.0" or "15230.75" would abort a BIGINT COPY.
+POSTGRES_TYPES = {
+    "b": "BOOLEAN",
+    "i": "NUMERIC",
+    "u": "NUMERIC",
+    "f": "DOUBLE PRECISION",
+    "M": "TIMESTAMP",
+}
+
+# Spellings Postgres would accept for a BOOLEAN, plus the Y/N flags common in the source workbooks
+BOOLEAN_VALUES = {
+    "true": True, "t": True, "yes": True, "y": True, "1": True, "1.0": True,
+    "false": False, "f": False, "no": False, "n": False, "0": False, "0.0": False,
+}
+
+
+def infer_schema(df):
+    """ Maps each column of the source (condensed) frame to a Postgres type; anything not clearly typed is TEXT. """
+    return {str(col): POSTGRES_TYPES.get(df[col].dtype.kind, "TEXT") for col in df.columns}
+
+
+def coerce_to_schema(df, schema):
+    """ Converts a generated batch to the table's types; values that don't fit become NULL instead of failing COPY. """
+    df = df.rename(columns=str)[list(schema)].copy()
+    for col, col_type in schema.items():
+        if col_type in ("NUMERIC", "DOUBLE PRECISION"):
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(",", ""), errors="coerce").where(df[col].notna())
+        elif col_type == "TIMESTAMP":
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif col_type == "BOOLEAN":
+            # Anything else the model wrote, such as "maybe", becomes NULL
+            df[col] = df[col].map(lambda value: BOOLEAN_VALUES.get(str(value).strip().lower()) if pd.notna(value) else None)
+    return df
+
+
+class PostgresCopySink:
+    def __init__(self, conninfo, table_name, schema, min_connections=1, max_connections=4):
+        """ schema: {column: Postgres type}, normally infer_schema() of the source frame the rows imitate. """
+        from psycopg import sql
+        from psycopg_pool import ConnectionPool
+
+        self.__sql = sql
+        self.__pool = ConnectionPool(conninfo, min_size=min_connections, max_size=max_connections, open=True)
+        self.table_name = table_name
+        self.__schema = schema
+        self.__table_ready = False
+        self.rows_written = 0
+
+    def __create_table(self, connection):
+        sql = self.__sql
+        columns = sql.SQL(", ").join(
+            sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL(col_type)) for col, col_type in self.__schema.items()
+        )
+        connection.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({})").format(sql.Identifier(self.table_name), columns))
+
+    def write_batch(self, df):
+        """ Streams one batch into the table with COPY FROM STDIN and commits it. """
+        if df.empty:
+            return 0
+
+        sql = self.__sql
+        with self.__pool.connection() as connection:
+            if not self.__table_ready:
+                self.__create_table(connection)
+            df = coerce_to_schema(df, self.__schema)
+
+            # CSV keeps COPY independent of the exact column types the model produced
+            buffer = io.StringIO()
+            df.to_csv(buffer, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+            buffer.seek(0)
+
+            copy_statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                sql.Identifier(self.table_name),
+                sql.SQL(", ").join(sql.Identifier(col) for col in self.__schema),
+            )
+            with connection.cursor() as cursor:
+                with cursor.copy(copy_statement) as copy:
+                    while data := buffer.read(1 << 16):
+                        copy.write(data)
+            # Leaving the pool's connection block commits this batch
+
+        # Only now is the CREATE TABLE committed; had the COPY failed, it would have rolled back with it
+        self.__table_ready = True
+        self.rows_written += len(df)
+        return len(df)
+
+    def close(self):
+        self.__pool.close()
+
+
+def write_dataframe_to_postgres(df, conninfo, table_name, schema, batch_size=10000):
+    """ Writes a finished DataFrame in committed batches, the database counterpart of save_dataframe_to_excel. """
+    sink = PostgresCopySink(conninfo, table_name, schema)
+    try:
+        for start in range(0, len(df), batch_size):
+            sink.write_batch(df.iloc[start:start + batch_size])
+    finally:
+        sink.close()
+    return sink.rows_written
@@ -0,0 +1,288 @@
+import argparse
+import itertools
+import json
+import numpy as np
+import pandas as pd
+from data_loader import DatasetReader
+
+
+def _to_float(values, is_datetime):
+    """ Numbers as float64; dates as int64 nanoseconds (as float64), so both sides compare on the same scale. """
+    if is_datetime:
+        nanoseconds = pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[ns]").view("int64")
+        return np.where(nanoseconds == np.iinfo(np.int64).min, np.nan, nanoseconds.astype(np.float64))
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _looks_like_dates(values):
+    """ True for datetime columns, and for text columns whose every value parses as a date but not as a number. """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return True
+    values = values.dropna()
+    if values.empty or pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return False
+    if pd.to_numeric(values, errors="coerce").notna().any():
+        return False
+    return bool(pd.to_datetime(values, errors="coerce").notna().all())
+
+
+class _StreamingProfile:
+    """ One-pass summary of a dataset: value counts, numeric samples, centred moments and row hashes. """
+
+    def __init__(self, numeric_columns, datetime_columns, categorical_columns, text_columns, sample_size, random_state,
+                 max_categories):
+        # Datetimes are compared as numbers; text columns only take part in the row hashes
+        self.numeric_columns = numeric_columns + datetime_columns
+        self.datetime_columns = set(datetime_columns)
+        self.categorical_columns = list(categorical_columns)
+        self.text_columns = list(text_columns)
+        # Fixed at the start, so moving a column to free text never changes how rows hash
+        self.hashed_text_columns = categorical_columns + text_columns
+        self.max_categories = max_categories
+        self.sample_size = sample_size
+        self.__rng = np.random.default_rng(random_state)
+
+        self.n_rows = 0
+        self.category_counts = {col: pd.Series(dtype=np.int64) for col in categorical_columns}
+        self.row_hashes = []
+
+        # Bottom-k sampling: every row draws a random key and the rows with the smallest keys are kept,
+        # which is a uniform sample that can be maintained chunk by chunk with vectorised operations
+        self.__sample_keys = np.empty(0)
+        self.numeric_sample = np.empty((0, len(self.numeric_columns)))
+
+        width = len(self.numeric_columns)
+        self.n_complete = 0
+        self.mean = np.zeros(width)
+        self.co_moments = np.zeros((width, width))
+
+    def update(self, chunk):
+        self.n_rows += len(chunk)
+
+        for col in list(self.categorical_columns):
+            counts = chunk[col].astype(str).value_counts()
+            self.category_counts[col] = self.category_counts[col].add(counts, fill_value=0)
+            if len(self.category_counts[col]) > self.max_categories:
+                # Looked categorical in the first chunk but keeps growing: treat it as free text from here on
+                self.categorical_columns.remove(col)
+                self.text_columns.append(col)
+                del self.category_counts[col]
+
+        numeric = np.empty((len(chunk), len(self.numeric_columns)))
+        for index, col in enumerate(self.numeric_columns):
+            numeric[:, index] = _to_float(chunk[col], col in self.datetime_columns)
+
+        # Hash numbers as floats so 100 in the source and 100.0 in the synthetic output count as the same value
+        hashed = pd.concat([
+            pd.DataFrame(numeric, columns=self.numeric_columns, index=chunk.index),
+            chunk[self.hashed_text_columns].astype(str),
+        ], axis=1)
+        self.row_hashes.append(pd.util.hash_pandas_object(hashed, index=False).values)
+
+        keys = np.concatenate([self.__sample_keys, self.__rng.random(len(numeric))])
+        values = np.concatenate([self.numeric_sample, numeric])
+        if len(keys) > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            keys, values = keys[keep], values[keep]
+        self.__sample_keys, self.numeric_sample = keys, values
+
+        complete = numeric[~np.isnan(numeric).any(axis=1)]
+        if len(complete):
+            # Chan et al.: merge this chunk's centred co-moments into the running ones. Raw E[xx] - E[x]E[x]
+            # cancels catastrophically for large values such as amounts or nanosecond timestamps
+            n_chunk = len(complete)
+            chunk_mean = complete.mean(axis=0)
+            centred = complete - chunk_mean
+            delta = chunk_mean - self.mean
+            n_total = self.n_complete + n_chunk
+            self.co_moments += centred.T @ centred + np.outer(delta, delta) * self.n_complete * n_chunk / n_total
+            self.mean += delta * n_chunk / n_total
+            self.n_complete = n_total
+
+    def correlation(self):
+        if self.n_complete < 2:
+            return np.full((len(self.numeric_columns),) * 2, np.nan)
+        covariance = self.co_moments / self.n_complete
+        std = np.sqrt(np.clip(np.diag(covariance), 0, None))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return covariance / np.outer(std, std)
+
+    def hashes(self):
+        """ One hash per row, duplicates included, so rates over them are rates over rows. """
+        return np.concatenate(self.row_hashes) if self.row_hashes else np.empty(0, dtype=np.uint64)
+
+
+def ks_distance(source, synthetic):
+    """ Two-sample Kolmogorov-Smirnov statistic: the largest gap between the two empirical CDFs. """
+    source = np.sort(source[~np.isnan(source)])
+    synthetic = np.sort(synthetic[~np.isnan(synthetic)])
+    if len(source) == 0 or len(synthetic) == 0:
+        return np.nan
+    points = np.concatenate([source, synthetic])
+    source_cdf = np.searchsorted(source, points, side="right") / len(source)
+    synthetic_cdf = np.searchsorted(synthetic, points, side="right") / len(synthetic)
+    return float(np.abs(source_cdf - synthetic_cdf).max())
+
+
+def total_variation(source_counts, synthetic_counts):
+    """ Total variation distance between two categorical distributions given as value counts. """
+    source_p = source_counts / max(source_counts.sum(), 1)
+    synthetic_p = synthetic_counts / max(synthetic_counts.sum(), 1)
+    source_p, synthetic_p = source_p.align(synthetic_p, fill_value=0)
+    return float(0.5 * np.abs(source_p - synthetic_p).sum())
+
+
+def nearest_neighbor_distances(queries, index, exclude_self=False):
+    """ Euclidean distance from each query to its nearest row of index, computed in blocks with matrix products. """
+    # Keep each block's distance matrix around 16M entries (128 MB) however large the index is
+    block_size = max(1, (1 << 24) // max(1, len(index)))
+    index_norms = (index ** 2).sum(axis=1)
+    distances = np.empty(len(queries))
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size]
+        squared = (block ** 2).sum(axis=1)[:, None] + index_norms[None, :] - 2 * block @ index.T
+        if exclude_self:
+            # Queries are the first rows of index here, so mask each query's distance to itself
+            rows = np.arange(len(block))
+            squared[rows, start + rows] = np.inf
+        distances[start:start + block_size] = np.sqrt(np.clip(squared.min(axis=1), 0, None))
+    return distances
+
+
+class FidelityEvaluator:
+    def __init__(self, source_reader, synthetic_reader, sample_size=200000, nn_queries=5000, random_state=42, max_categories=100):
+        """ Columns with more than max_categories distinct values are treated as free text and get no TV score. """
+        self.__source_reader = source_reader
+        self.__synthetic_reader = synthetic_reader
+        self.__sample_size = sample_size
+        self.__nn_queries = nn_queries
+        self.__random_state = random_state
+        self.__max_categories = max_categories
+        self.scorecard = None
+
+    def __split_columns(self, source_chunk, synthetic_columns):
+        """ Sorts the shared columns into numeric, datetime, low-cardinality categorical and free-text columns. """
+        # Judged on the first chunk so the data is still read only once; categorical columns that outgrow
+        # max_categories later are moved to free text while profiling
+        columns = [col for col in source_chunk.columns if col in set(synthetic_columns)]
+        numeric_columns, datetime_columns, categorical_columns, text_columns = [], [], [], []
+        for col in columns:
+            values = source_chunk[col]
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                numeric_columns.append(col)
+            elif _looks_like_dates(values):
+                datetime_columns.append(col)
+            elif values.nunique() <= self.__max_categories:
+                categorical_columns.append(col)
+            else:
+                text_columns.append(col)
+        return numeric_columns, datetime_columns, categorical_columns, text_columns
+
+    def __profile(self, chunks, numeric_columns, datetime_columns, categorical_columns, text_columns):
+        profile = _StreamingProfile(numeric_columns, datetime_columns, categorical_columns, text_columns,
+                                    self.__sample_size, self.__random_state, self.__max_categories)
+        for chunk in chunks:
+            profile.update(chunk)
+        return profile
+
+    def __privacy(self, source, synthetic):
+        # Every synthetic row counts, so a source row the model repeated ten times weighs ten times
+        copied = np.isin(synthetic.hashes(), np.unique(source.hashes()))
+        privacy = {"exact_copy_rate": float(copied.mean()) if len(copied) else 0.0}
+
+        source_sample = source.numeric_sample[~np.isnan(source.numeric_sample).any(axis=1)]
+        synthetic_sample = synthetic.numeric_sample[~np.isnan(synthetic.numeric_sample).any(axis=1)]
+        if len(source_sample) < 2 or len(synthetic_sample) == 0:
+            return privacy
+
+        # Standardise with the source scale so no single wide column dominates the distance
+        mean = source_sample.mean(axis=0)
+        std = source_sample.std(axis=0)
+        std[std == 0] = 1
+        index = (source_sample - mean) / std
+        queries = (synthetic_sample[:self.__nn_queries] - mean) / std
+
+        # Distances between source rows give the baseline a privacy-safe generator should not undercut
+        synthetic_dcr = nearest_neighbor_distances(queries, index)
+        baseline_dcr = nearest_neighbor_distances(index[:self.__nn_queries], index, exclude_self=True)
+        privacy.update({
+            "dcr_median": float(np.median(synthetic_dcr)),
+            "dcr_p05": float(np.percentile(synthetic_dcr, 5)),
+            "source_nn_median": float(np.median(baseline_dcr)),
+            "source_nn_p05": float(np.percentile(baseline_dcr, 5)),
+        })
+        return privacy
+
+    def evaluate(self):
+        """ Streams both datasets once and builds the fidelity and privacy scorecard. """
+        # The first chunk of each side decides which columns are compared and how, then is profiled with the rest
+        source_chunks = self.__source_reader.iter_chunks()
+        synthetic_chunks = self.__synthetic_reader.iter_chunks()
+        first_source_chunk = next(source_chunks)
+        first_synthetic_chunk = next(synthetic_chunks)
+        split = self.__split_columns(first_source_chunk, first_synthetic_chunk.columns)
+        numeric_columns, datetime_columns, categorical_columns, text_columns = split
+
+        source = self.__profile(itertools.chain([first_source_chunk], source_chunks), *split)
+        synthetic = self.__profile(itertools.chain([first_synthetic_chunk], synthetic_chunks), *split)
+        # A column that turned out high-cardinality on either side is free text for both
+        categorical_columns = [col for col in categorical_columns
+                               if col in source.categorical_columns and col in synthetic.categorical_columns]
+        text_columns = [col for col in split[2] + split[3] if col not in categorical_columns]
+
+        columns = {}
+        for index, col in enumerate(numeric_columns + datetime_columns):
+            column_type = "numeric" if col in numeric_columns else "datetime"
+            columns[col] = {"type": column_type, "ks": ks_distance(source.numeric_sample[:, index], synthetic.numeric_sample[:, index])}
+        for col in categorical_columns:
+            columns[col] = {"type": "categorical", "tv": total_variation(source.category_counts[col], synthetic.category_counts[col])}
+        for col in text_columns:
+            # Free text has no meaningful value distribution to compare; it still counts towards exact copies
+            columns[col] = {"type": "text"}
+
+        drift = np.abs(source.correlation() - synthetic.correlation())
+        self.scorecard = {
+            "source_rows": source.n_rows,
+            "synthetic_rows": synthetic.n_rows,
+            "columns": columns,
+            "correlation_drift": {
+                "max": float(np.nanmax(drift)) if np.isfinite(drift).any() else None,
+                "mean": float(np.nanmean(drift)) if np.isfinite(drift).any() else None,
+            },
+            "privacy": self.__privacy(source, synthetic),
+        }
+        return self.scorecard
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a synthetic dataset against its source for fidelity and privacy.")
+    parser.add_argument("--source", default="Dataset.xlsx")
+    parser.add_argument("--source-sheet", default="Sheet1")
+    parser.add_argument("--synthetic", required=True)
+    parser.add_argument("--synthetic-sheet", default="Sheet1")
+    parser.add_argument("--output", help="Write the scorecard to this JSON file")
+    args = parser.parse_args()
+
+    evaluator = FidelityEvaluator(
+        DatasetReader(args.source, sheet_name=args.source_sheet),
+        DatasetReader(args.synthetic, sheet_name=args.synthetic_sheet),
+    )
+    scorecard = evaluator.evaluate()
+
+    print(f"Source rows: {scorecard['source_rows']}, synthetic rows: {scorecard['synthetic_rows']}")
+    for col, scores in scorecard["columns"].items():
+        if scores["type"] == "text":
+            print(f"  {col:<40} free text, not scored")
+            continue
+        metric = "tv" if scores["type"] == "categorical" else "ks"
+        print(f"  {col:<40} {metric} = {scores[metric]:.4f}")
+    print(f"Correlation drift: {scorecard['correlation_drift']}")
+    print(f"Privacy: {scorecard['privacy']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(scorecard, file, indent=4, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import functools
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+MODEL_NAME = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
+MODEL_PATH = "./"
+N_CTX = 8192
+PROFILE_FILE = "inference_profiles.json"
+
+_executor = None
+
+
+def _profile_path(model_path):
+    return os.path.join(model_path, PROFILE_FILE)
+
+
+def load_inference_profile(model_name=MODEL_NAME, model_path=MODEL_PATH):
+    """ Returns the settings tune_inference.py stored for this host and model, or None. """
+    path = _profile_path(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        profiles = json.load(file)
+    return profiles.get(socket.gethostname(), {}).get(model_name)
+
+
+def save_inference_profile(model_name, profile, model_path=MODEL_PATH):
+    """ Records the tuned settings for this host and model, keeping other hosts' entries. """
+    path = _profile_path(model_path)
+    profiles = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            profiles = json.load(file)
+    profiles.setdefault(socket.gethostname(), {})[model_name] = profile
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(profiles, file, indent=4)
+    return path
+
+
+def load_model(model_name=MODEL_NAME, model_path=MODEL_PATH, n_ctx=N_CTX, apply_profile=True, **kwargs):
+    """ Loads the GGUF model. gpt4all is imported here so scripts that never touch the LLM don't pay for it. """
+    from gpt4all import GPT4All
+
+    profile = load_inference_profile(model_name, model_path) if apply_profile else None
+    if profile:
+        kwargs.setdefault("n_threads", profile["n_threads"])
+        # A tuned context is only used if it still fits the prompts this caller needs
+        n_ctx = max(n_ctx, profile.get("n_ctx", n_ctx))
+
+    # llama.cpp memory-maps the weights file, so pages are only faulted in as they are first used
+    model = GPT4All(model_name=model_name, model_path=model_path, allow_download=False, n_ctx=n_ctx, **kwargs)
+
+    if profile and "n_batch" in profile:
+        # Prompt batch size is a per-call argument in gpt4all, so default it here; explicit n_batch still wins
+        model.generate = functools.partial(model.generate, n_batch=profile["n_batch"])
+    return model
+
+
+def threads_per_worker(n_workers, model_name=MODEL_NAME, model_path=MODEL_PATH):
+    """ Splits the tuned (or all) CPU threads between n_workers model instances so they don't oversubscribe the cores. """
+    profile = load_inference_profile(model_name, model_path)
+    n_threads = profile["n_threads"] if profile else (os.cpu_count() or 1)
+    return max(1, n_threads // max(1, n_workers))
+
+
+def set_thread_count(model, n_threads):
+    """ Changes the thread count of an already loaded model; gpt4all exposes it on the underlying LLModel. """
+    if hasattr(model, "model") and hasattr(model.model, "set_thread_count"):
+        model.model.set_thread_count(n_threads)
+    return model
+
+
+def load_model_async(model_name=MODEL_NAME, model_path=MODEL_PATH, n_ctx=N_CTX, **kwargs):
+    """ Starts loading the model on a background thread and returns a future that resolves to it. """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+    return _executor.submit(load_model, model_name, model_path, n_ctx, **kwargs)
+
+
+def resolve_model(model):
+    """ Accepts a loaded model, a future from load_model_async, a factory returning either, or None (load synchronously). """
+    if callable(model) and not hasattr(model, "generate"):
+        # A factory lets callers defer even starting the load until the model is actually needed
+        model = model()
+    if model is None:
+        return load_model()
+    if hasattr(model, "result"):
+        return model.result()
+    return model
@@ -0,0 +1,102 @@
+import json
+from model_loader import resolve_model
+
+GENERATION_STRATEGIES = ("llm", "sample")
+# Bump whenever the planning prompt changes so cached plans are not reused
+PROMPT_VERSION = 1
+
+
+class PipelinePlanner:
+    def __init__(self, model=None, max_bucket_size=10):
+        # Callers that already hold a loaded model (or its future) should pass it in rather than loading a second copy
+        self.__model = resolve_model(model)
+        self.__max_bucket_size = max_bucket_size
+        self.__base_prompt = '''
+        You are planning a synthetic data generation job. Given dataset headers and sample rows:
+
+        1. Classify the dataset as one of:
+           - Financial Data (transactions, account balances, revenues, invoices)
+           - Customer Data (names, emails, phone numbers, addresses)
+           - Other Data (if it doesn't fit the above)
+        2. Choose the columns to keep, discarding:
+           - IDs (e.g., transaction IDs, CUSIP, ISIN)
+           - Binary columns (Yes/No, Y/N)
+           - Redundant or irrelevant fields
+           Keep dates and timestamps, monetary values and free-text descriptions.
+        3. For every kept column, choose a generation strategy:
+           - "llm" for values the model should invent (names, descriptions, amounts, dates)
+           - "sample" for categorical columns with a small set of repeating values
+        4. Suggest how many rows to generate per model call (bucket_size), keeping each call well inside 8192 tokens.
+
+        Return only a JSON object of the form:
+        {"category": "...", "keep_columns": ["..."], "column_strategies": {"column": "llm"}, "bucket_size": 5}
+        '''
+
+    def __parse_json(self, response):
+        try:
+            json_start = response.find("{")
+            json_end = response.rfind("}") + 1
+            if json_start == -1 or json_end == 0:
+                return None
+
+            parsed_json = json.loads(response[json_start:json_end])
+            if isinstance(parsed_json, dict) and isinstance(parsed_json.get("keep_columns"), list):
+                return parsed_json
+            return None
+        except (json.JSONDecodeError, AttributeError):
+            return None
+
+    # Rough token estimate of one row, used when the model does not suggest a usable bucket size
+    def __default_bucket_size(self, sample_df, columns):
+        if sample_df.empty or not columns:
+            return self.__max_bucket_size
+        row_tokens = len(json.dumps(sample_df[columns].iloc[0].tolist(), default=str)) // 4
+        return max(1, min(self.__max_bucket_size, 4000 // max(1, row_tokens)))
+
+    def __normalise_plan(self, plan, sample_df):
+        columns = sample_df.columns.tolist()
+        keep_columns = [col for col in plan.get("keep_columns", []) if col in columns]
+        if not keep_columns:
+            keep_columns = columns
+
+        strategies = plan.get("column_strategies")
+        if not isinstance(strategies, dict):
+            strategies = {}
+        column_strategies = {}
+        for col in keep_columns:
+            strategy = strategies.get(col, "llm")
+            column_strategies[col] = strategy if strategy in GENERATION_STRATEGIES else "llm"
+
+        bucket_size = plan.get("bucket_size")
+        if not isinstance(bucket_size, int) or bucket_size <= 0:
+            bucket_size = self.__default_bucket_size(sample_df, keep_columns)
+
+        return {
+            "category": str(plan.get("category", "Other Data")).strip(),
+            "keep_columns": keep_columns,
+            "column_strategies": column_strategies,
+            "bucket_size": min(bucket_size, self.__max_bucket_size),
+        }
+
+    def plan(self, sample_df, column_profiles=None):
+        """ Classifies the dataset and plans column selection and generation in a single model call. """
+        column_names = json.dumps(sample_df.columns.tolist(), indent=4)
+        sample_rows = json.dumps(sample_df.head(5).values.tolist(), indent=4, default=str)
+
+        prompt = f"{self.__base_prompt}\nColumns: {column_names}\nSample Rows: {sample_rows}\n"
+        if column_profiles:
+            # Distinct counts tell the model which columns are categorical without showing it more rows
+            n_distinct = {col: profile.get("n_distinct") for col, profile in column_profiles.items()}
+            prompt += f"Distinct values per column (null means many): {json.dumps(n_distinct)}\n"
+
+        plan = None
+        with self.__model.chat_session():
+            iterations = 0
+            while plan is None:
+                if iterations > 6:
+                    raise SystemExit("Stuck in loop. Please run again.")
+                response = self.__model.generate(prompt, max_tokens=1024)
+                plan = self.__parse_json(response)
+                iterations += 1
+
+        return self.__normalise_plan(plan, sample_df)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+
+def file_hash(path, block_size=1 << 20):
+    """ Hashes a file's bytes, which is far cheaper than parsing it. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def column_hashes(df):
+    """ Content hash of every column, so a change to one column only invalidates what depends on it. """
+    hashes = {}
+    for col in df.columns:
+        values = pd.util.hash_pandas_object(df[col], index=False).values
+        hashes[str(col)] = hashlib.sha256(values.tobytes()).hexdigest()
+    return hashes
+
+
+def row_hashes(df, dtypes):
+    """ uint64 hash per row, with values normalised by the source dtypes so source and model output compare equal. """
+    normalised = {}
+    for col in df.columns:
+        dtype = dtypes[col]
+        values = df[col]
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            # Timestamp('2024-03-14 00:00:00') and "2024-03-14" both become the same int64 nanoseconds
+            timestamps = pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[ns]")
+            normalised[col] = timestamps.view("int64")
+        elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            # 100, 100.0 and "100" all hash as the same float; missing values become NaN
+            normalised[col] = pd.to_numeric(values, errors="coerce").astype("float64")
+        else:
+            normalised[col] = values.where(values.notna(), "").astype(str)
+    return pd.util.hash_pandas_object(pd.DataFrame(normalised, index=df.index), index=False).to_numpy()
+
+
+class StageCache:
+    def __init__(self, cache_dir=".pipeline_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __key(self, stage, inputs):
+        payload = json.dumps({"stage": stage, "inputs": inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __artifact_path(self, stage, key):
+        return os.path.join(self.cache_dir, f"{stage}_{key}.pkl")
+
+    def run(self, stage, inputs, compute):
+        """ Returns the stored output for these inputs, or computes, stores and returns it. """
+        path = self.__artifact_path(stage, self.__key(stage, inputs))
+        if os.path.exists(path):
+            print(f"Reusing cached {stage} output")
+            return pd.read_pickle(path)
+
+        artifact = compute()
+
+        # Write to a temporary file first so an interrupted run never leaves a truncated artifact behind
+        pd.to_pickle(artifact, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return artifact
@@ -0,0 +1,253 @@
+import json
+import os
+import re
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from airflow.decorators import dag, task
+from airflow.operators.python import get_current_context
+from airflow.sensors.python import PythonSensor
+from airflow.utils.dates import days_ago
+from model_loader import MODEL_NAME, MODEL_PATH, load_model
+from stage_cache import row_hashes
+
+
+class StubModel:
+    """ Stands in for GPT4All so the DAG can run end to end with dag.test() on a machine without the weights. """
+
+    def __init__(self, start=None):
+        if start is None:
+            # Each mapped generate task counts from three rows per bucket, so neighbouring buckets repeat rows the
+            # way independent model calls do and dag.test() exercises the cross-bucket dedup and top-up.
+            # Top-up calls in merge start past every bucket's range.
+            ti = get_current_context()["ti"]
+            index = max(ti.map_index, 0)
+            start = index * 3 if ti.task_id == "generate" else 1000000 + index * 1000
+        self.__n_generated = start
+
+    @contextmanager
+    def chat_session(self):
+        yield self
+
+    def generate(self, prompt, **kwargs):
+        if "planning a synthetic data generation job" in prompt:
+            # An empty keep_columns list makes the planner keep every column
+            return json.dumps({"category": "Financial Data", "keep_columns": [], "column_strategies": {}, "bucket_size": 5})
+
+        n_rows = int(re.search(r"Please generate (\d+) rows", prompt).group(1))
+        columns = json.loads(re.search(r"Column Names: (\[.*?\])\n", prompt, re.DOTALL).group(1))
+        # Values are unique within one stub, so only repeats across buckets need the DAG's dedup
+        rows = [[f"{col} {self.__n_generated + i}" for col in columns] for i in range(n_rows)]
+        self.__n_generated += n_rows
+        return f"```json\n{json.dumps(rows)}\n```"
+
+
+def _artifact_path(artifact_dir, *parts):
+    """ Builds a per-run artifact path; tasks exchange these paths through XCom, never the data itself. """
+    run_id = re.sub(r"[^A-Za-z0-9_.-]", "_", get_current_context()["run_id"])
+    path = os.path.join(artifact_dir, run_id, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _table_for_dataset(table_name, dataset):
+    """ Each dataset has its own columns, so it gets its own table: an explicit mapping entry or <table_name>_<file stem>. """
+    if isinstance(table_name, dict):
+        return table_name[dataset]
+    stem = re.sub(r"[^A-Za-z0-9_]", "_", os.path.splitext(os.path.basename(dataset))[0]).lower()
+    return f"{table_name}_{stem}"
+
+
+def build_synthetic_data_dag(dag_id="synthetic_data_pipeline", datasets=("Dataset.xlsx",), sheet_name="Sheet1",
+                             n_synthetic_rows=10, artifact_dir="/tmp/synthetic_data", output_dir=".",
+                             model_factory=load_model, model_file=os.path.join(MODEL_PATH, MODEL_NAME),
+                             database_conninfo=None, table_name="synthetic_data"):
+    """ Builds the load -> plan -> generate buckets -> validate -> write pipeline as a DAG mapped over datasets and buckets.
+
+    table_name is either a prefix (one table per dataset file) or a {dataset: table} mapping.
+    """
+
+    @dag(dag_id=dag_id, start_date=days_ago(1), schedule_interval=None, catchup=False, tags=["synthetic-data"])
+    def synthetic_data_pipeline():
+
+        # Only wait for the weights when the real model is used; the stub needs no file
+        model_ready = PythonSensor(
+            task_id="wait_for_model",
+            python_callable=lambda: model_factory is not load_model or os.path.exists(model_file),
+            poke_interval=30,
+            timeout=60 * 60,
+            mode="reschedule",
+        )
+
+        @task
+        def load(dataset):
+            from data_loader import DatasetReader
+
+            reader = DatasetReader(dataset, sheet_name=sheet_name, sample_size=10)
+            sample_df = reader.scan()
+            path = _artifact_path(artifact_dir, os.path.basename(dataset), "sample.pkl")
+            pd.to_pickle({"dataset": dataset, "sample_df": sample_df, "column_profiles": reader.column_profiles}, path)
+            return path
+
+        @task
+        def plan(load_path):
+            from data_loader import DatasetReader
+            from pipeline_planner import PipelinePlanner
+
+            loaded = pd.read_pickle(load_path)
+            dataset_plan = PipelinePlanner(model=model_factory()).plan(loaded["sample_df"], column_profiles=loaded["column_profiles"])
+
+            # Only the kept columns of the full dataset are ever materialized
+            reader = DatasetReader(loaded["dataset"], sheet_name=sheet_name)
+            condensed_df = reader.read_columns(dataset_plan["keep_columns"])
+            condensed_path = _artifact_path(artifact_dir, os.path.basename(loaded["dataset"]), "condensed.pkl")
+            condensed_df.to_pickle(condensed_path)
+
+            # Hash the source rows once per dataset here, so each validate task only loads a sorted uint64 array
+            source_hashes_path = _artifact_path(artifact_dir, os.path.basename(loaded["dataset"]), "source_hashes.pkl")
+            pd.to_pickle({"dtypes": condensed_df.dtypes, "hashes": np.unique(row_hashes(condensed_df, condensed_df.dtypes))},
+                         source_hashes_path)
+
+            plan_path = _artifact_path(artifact_dir, os.path.basename(loaded["dataset"]), "plan.json")
+            with open(plan_path, "w", encoding="utf-8") as file:
+                json.dump(dataset_plan, file, indent=4)
+            return {"dataset": loaded["dataset"], "plan": plan_path, "condensed": condensed_path, "source_hashes": source_hashes_path}
+
+        @task
+        def split_buckets(planned):
+            # Mapped plan outputs arrive as one list per dataset; flatten them so generation maps over every bucket
+            buckets = []
+            for dataset_plan in planned:
+                with open(dataset_plan["plan"], "r", encoding="utf-8") as file:
+                    bucket_size = json.load(file)["bucket_size"]
+                for index, start in enumerate(range(0, n_synthetic_rows, bucket_size)):
+                    buckets.append(dict(dataset_plan, bucket=index, n_rows=min(bucket_size, n_synthetic_rows - start)))
+            return buckets
+
+        @task
+        def generate(bucket):
+            from synthetic_data_generation import AcceptanceTracker, SyntheticDataGenerator
+
+            condensed_df = pd.read_pickle(bucket["condensed"])
+            source = pd.read_pickle(bucket["source_hashes"])
+            # Acceptance rates outlive a single run, so they sit in artifact_dir rather than the run folder
+            tracker = AcceptanceTracker(os.path.basename(bucket["dataset"]), path=os.path.join(artifact_dir, "acceptance_rates.json"))
+            # The source rows were hashed once in plan; no bucket hashes the condensed frame again
+            generator = SyntheticDataGenerator(input_df=condensed_df, n_synthetic_rows=bucket["n_rows"],
+                                               bucket_size=bucket["n_rows"], model=model_factory(), acceptance_tracker=tracker,
+                                               source_hashes=source["hashes"])
+            generator.generate_synthetic_data()
+
+            path = _artifact_path(artifact_dir, os.path.basename(bucket["dataset"]), f"generated_{bucket['bucket']}.pkl")
+            generator.generated_df.head(bucket["n_rows"]).to_pickle(path)
+            return dict(bucket, generated=path)
+
+        @task
+        def validate(bucket):
+            generated_df = pd.read_pickle(bucket["generated"])
+            source = pd.read_pickle(bucket["source_hashes"])
+
+            # Drop empty and duplicate rows, and any row copied verbatim from the source data
+            generated_df = generated_df.dropna(how="all")
+            hashes = row_hashes(generated_df, source["dtypes"])
+            keep = ~pd.Series(hashes).duplicated().to_numpy() & ~np.isin(hashes, source["hashes"])
+            generated_df = generated_df[keep]
+
+            path = os.path.join(os.path.dirname(bucket["generated"]), f"validated_{bucket['bucket']}.pkl")
+            generated_df.to_pickle(path)
+            return dict(bucket, validated=path)
+
+        @task
+        def group_buckets(validated):
+            # Regroup the mapped validate outputs per dataset, since duplicates can only be found across all its buckets
+            groups = {}
+            for bucket in validated:
+                group = groups.setdefault(bucket["dataset"], {
+                    "dataset": bucket["dataset"], "plan": bucket["plan"], "condensed": bucket["condensed"],
+                    "source_hashes": bucket["source_hashes"], "validated": [],
+                })
+                group["validated"].append(bucket["validated"])
+            return list(groups.values())
+
+        @task
+        def merge(group):
+            from synthetic_data_generation import AcceptanceTracker, SyntheticDataGenerator
+
+            source = pd.read_pickle(group["source_hashes"])
+            synthetic_df = pd.concat([pd.read_pickle(path) for path in group["validated"]], ignore_index=True)
+
+            # Every bucket had its own generator, so the same row can come back from several of them
+            hashes = row_hashes(synthetic_df, source["dtypes"])
+            keep = ~pd.Series(hashes).duplicated().to_numpy()
+            synthetic_df, hashes = synthetic_df[keep].reset_index(drop=True), hashes[keep]
+
+            # Top up the rows dropped by dedup and validation, rejecting source rows and every row already kept
+            iterations = 0
+            while len(synthetic_df) < n_synthetic_rows:
+                if iterations > 6:
+                    raise SystemExit("Stuck in loop. Please run again.")
+                if iterations == 0:
+                    condensed_df = pd.read_pickle(group["condensed"])
+                    with open(group["plan"], "r", encoding="utf-8") as file:
+                        bucket_size = json.load(file)["bucket_size"]
+                    tracker = AcceptanceTracker(os.path.basename(group["dataset"]), path=os.path.join(artifact_dir, "acceptance_rates.json"))
+                    model = model_factory()
+                iterations += 1
+
+                n_missing = n_synthetic_rows - len(synthetic_df)
+                generator = SyntheticDataGenerator(input_df=condensed_df, n_synthetic_rows=n_missing, bucket_size=bucket_size,
+                                                   model=model, acceptance_tracker=tracker,
+                                                   source_hashes=np.union1d(source["hashes"], hashes))
+                generator.generate_synthetic_data()
+                extra_df = generator.generated_df.head(n_missing).dropna(how="all")
+                print(f"Topped up {len(extra_df)} of {n_missing} missing rows for {group['dataset']}")
+                synthetic_df = pd.concat([synthetic_df, extra_df], ignore_index=True)
+                hashes = np.concatenate([hashes, row_hashes(extra_df, source["dtypes"])])
+
+            path = _artifact_path(artifact_dir, os.path.basename(group["dataset"]), "merged.pkl")
+            synthetic_df.to_pickle(path)
+            return {"dataset": group["dataset"], "condensed": group["condensed"], "merged": path}
+
+        @task
+        def write(merged):
+            from synthetic_data_generation import save_dataframe_to_excel
+
+            os.makedirs(output_dir, exist_ok=True)
+            filenames = []
+            for group in merged:
+                synthetic_df = pd.read_pickle(group["merged"])
+                filenames.append(save_dataframe_to_excel(synthetic_df, output_dir=output_dir))
+                print(f"Wrote {len(synthetic_df)} synthetic rows for {group['dataset']} to {filenames[-1]}")
+
+                if database_conninfo:
+                    from db_sink import infer_schema, write_dataframe_to_postgres
+
+                    schema = infer_schema(pd.read_pickle(group["condensed"]))
+                    write_dataframe_to_postgres(synthetic_df, database_conninfo, _table_for_dataset(table_name, group["dataset"]), schema)
+            return filenames
+
+        loaded = load.expand(dataset=list(datasets))
+        planned = plan.expand(load_path=loaded)
+        model_ready >> planned
+
+        generated = generate.expand(bucket=split_buckets(planned))
+        validated = validate.expand(bucket=generated)
+        write(merge.expand(group=group_buckets(validated)))
+
+    return synthetic_data_pipeline()
+
+
+dag = build_synthetic_data_dag()
+
+
+if __name__ == "__main__":
+    # Local smoke test: runs every task in-process against the stub model, then checks every dataset got
+    # exactly n_synthetic_rows distinct rows even though the stub repeats rows across buckets
+    n_test_rows = 10
+    test_run = build_synthetic_data_dag(dag_id="synthetic_data_pipeline_test", n_synthetic_rows=n_test_rows,
+                                        model_factory=StubModel).test()
+    for filename in test_run.get_task_instance("write").xcom_pull(task_ids="write"):
+        written_df = pd.read_excel(filename)
+        if len(written_df) != n_test_rows or written_df.duplicated().any():
+            raise SystemExit(f"{filename}: expected {n_test_rows} distinct rows, got {len(written_df.drop_duplicates())} of {len(written_df)}")
+        print(f"{filename}: {n_test_rows} distinct rows")
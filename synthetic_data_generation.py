@@ -1,13 +1,25 @@
+import argparse
 import datetime
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
 import pandas as pd
-from gpt4all import GPT4All
 import json
 import re
 from openpyxl import load_workbook
 import math
+import numpy as np
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from columnar_builder import ColumnarRowBuilder
+from data_loader import DatasetReader
+from db_sink import PostgresCopySink, infer_schema
+from model_loader import load_model, load_model_async, resolve_model, set_thread_count, threads_per_worker
+from stage_cache import row_hashes
 
 class DataPreprocessor:
-    def __init__(self):
+    def __init__(self, model=None):
         self.tokens = 0
         self.__original_df = None
         self.__columns = []
@@ -24,7 +36,7 @@ I want to mostly keep columns which have dates, times and free text (names, desc
 
 So, please mention the column names which should be retained. Also, make sure that the retained column names are displayed as a json list. For example: ["Column1", "Column2", "Column3"]
         '''
-        self.__model = GPT4All(model_name='Meta-Llama-3-8B-Instruct.Q4_0.gguf', model_path='./', allow_download=False, n_ctx=8192)
+        self.__model = resolve_model(model)
 
     # Performs a very rough calculation of the number of tokens in header and first row of given df
     def __calculate_tokens(self, df):
@@ -106,10 +118,10 @@ So, please mention the column names which should be retained. Also, make sure th
 
         return split_dfs
 
-    def preprocess_data(self, df):
-        self.__original_df = df
-
-        df = df.sample(1)
+    # Decides which columns to keep from sample rows alone, so the caller can defer loading the full dataset
+    def select_columns(self, sample_df):
+        self.__columns = []
+        df = sample_df.sample(1)
 
         header_tokens, row_tokens = self.__calculate_tokens(df)
         tokens = header_tokens + row_tokens
@@ -125,13 +137,135 @@ So, please mention the column names which should be retained. Also, make sure th
         for split_df in split_dataframes:
             self.__keep_relevant_rows(split_df)
 
-        condensed_df = self.__original_df[self.__columns]
+        return list(self.__columns)
+
+    def preprocess_data(self, df):
+        self.__original_df = df
+
+        condensed_df = self.__original_df[self.select_columns(df)]
         return condensed_df
 
 
+# Extracts the list of generated rows from the fenced JSON block of a model response
+def parse_generated_rows(response):
+    try:
+        start = response.find("```") + len("```")
+        end = response.rfind("```")
+        if start == -1 or end == -1:
+            return None
+        
+        response_section = response[start:end].strip()
+        json_start = response_section.find("[")
+        json_end = response_section.rfind("]") + 1
+        
+        if json_start == -1 or json_end == -1:
+            return None
+        
+        json_content = response_section[json_start:json_end]
+        parsed_json = json.loads(json_content)
+        
+        if isinstance(parsed_json, list) and all(isinstance(row, list) for row in parsed_json):
+            return parsed_json
+        else:
+            return None
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+class AcceptanceTracker:
+    def __init__(self, dataset_key, path = "acceptance_rates.json", prior_rate = 0.9, prior_weight = 10):
+        """ path=None keeps the counts in memory only, for throwaway generators such as skeletons. """
+        self.__dataset_key = dataset_key
+        self.__path = path
+        stats = {"requested": 0, "accepted": 0}
+        if path is not None:
+            with self.__locked():
+                stats = self.__read().get(dataset_key, stats)
+
+        # Start from a prior worth prior_weight rows so one unlucky call doesn't swing the estimate
+        self.__prior_accepted = prior_rate * prior_weight
+        self.__prior_requested = prior_weight
+        self.requested = stats["requested"]
+        self.accepted = stats["accepted"]
+        # Only this run's counts are written back, added to whatever other workers saved meanwhile
+        self.__new_requested = 0
+        self.__new_accepted = 0
+
+    @contextmanager
+    def __locked(self):
+        # Parallel DAG tasks share the file, so every read-modify-write holds an exclusive lock.
+        # The lock modules are imported here because each exists on only one platform.
+        with open(self.__path + ".lock", "a+") as lock_file:
+            if os.name == "nt":
+                import msvcrt
+
+                lock_file.seek(0)
+                while True:
+                    try:
+                        # LK_LOCK retries for about 10 seconds and then raises, so keep waiting
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+                try:
+                    yield
+                finally:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __read(self):
+        if not os.path.exists(self.__path):
+            return {}
+        with open(self.__path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def rate(self):
+        return (self.accepted + self.__prior_accepted) / (self.requested + self.__prior_requested)
+
+    def record(self, requested, accepted):
+        # The model sometimes returns more rows than asked for; that shouldn't push the rate above 1
+        accepted = min(accepted, requested)
+        self.requested += requested
+        self.accepted += accepted
+        self.__new_requested += requested
+        self.__new_accepted += accepted
+
+    def save(self):
+        if self.__path is None:
+            return
+        with self.__locked():
+            all_stats = self.__read()
+            stats = all_stats.setdefault(self.__dataset_key, {"requested": 0, "accepted": 0})
+            stats["requested"] += self.__new_requested
+            stats["accepted"] += self.__new_accepted
+
+            # A per-writer temporary file, so concurrent writers never rename each other's file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.__path)), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(all_stats, file, indent=4)
+            os.replace(tmp_path, self.__path)
+        self.__new_requested = 0
+        self.__new_accepted = 0
+
+
 class SyntheticDataGenerator:
-    def __init__(self, input_df, n_synthetic_rows = 2, custom_prompt = '', bucket_size = 5):
-        self.__model = GPT4All(model_name='Meta-Llama-3-8B-Instruct.Q4_0.gguf', model_path='./', allow_download=False, n_ctx=8192)
+    def __init__(self, input_df, n_synthetic_rows = 2, custom_prompt = '', bucket_size = 5, model = None, sink = None,
+                 acceptance_tracker = None, reject_duplicates = True, source_hashes = None):
+        self.__model = resolve_model(model)
+        # When False, only malformed rows are rejected; repeated rows and source copies are kept
+        self.__reject_duplicates = reject_duplicates
+        # Sorted uint64 row hashes (stage_cache.row_hashes) to reject; hashed from input_df when not given
+        self.__source_hashes = source_hashes
+        # Optional PostgresCopySink; each bucket is written as soon as it is parsed
+        self.__sink = sink
         self.__input_df = input_df
         self.__n_synthetic_rows = n_synthetic_rows
         self.__custom_prompt = custom_prompt
@@ -151,32 +285,17 @@ Make sure that your output is generated as a json, in the same format as the inp
         if self.__n_synthetic_rows < 2:
             self.__n_synthetic_rows = 2
 
+        # Acceptance rates are remembered per dataset, keyed by its column names
+        if acceptance_tracker is None:
+            dataset_key = hashlib.sha256(json.dumps([str(col) for col in input_df.columns]).encode("utf-8")).hexdigest()
+            acceptance_tracker = AcceptanceTracker(dataset_key)
+        self.__acceptance_tracker = acceptance_tracker
+
         self.generated_df = None
 
     def parse_json(self, response):
-        try:
-            start = response.find("```") + len("```")
-            end = response.rfind("```")
-            if start == -1 or end == -1:
-                return None
-            
-            response_section = response[start:end].strip()
-            json_start = response_section.find("[")
-            json_end = response_section.rfind("]") + 1
-            
-            if json_start == -1 or json_end == -1:
-                return None
-            
-            json_content = response_section[json_start:json_end]
-            parsed_json = json.loads(json_content)
-            
-            if isinstance(parsed_json, list) and all(isinstance(row, list) for row in parsed_json):
-                return parsed_json
-            else:
-                return None
-        except (json.JSONDecodeError, AttributeError):
-            return None
-        
+        return parse_generated_rows(response)
+
     def generate_rows(self, n_rows):
         df = self.__input_df.sample(min(n_rows, len(self.__input_df)))
 
@@ -200,33 +319,268 @@ Make sure that your output is generated as a json, in the same format as the inp
 
         return data
 
+    # Keeps rows of the right width that are neither repeats of accepted rows nor copies of source rows
+    def __accept_rows(self, rows, source_hashes, seen_hashes):
+        rows = [row for row in rows if len(row) == len(self.__input_df.columns)]
+        if not self.__reject_duplicates or not rows:
+            return rows
+
+        batch_hashes = row_hashes(pd.DataFrame(rows, columns=self.__input_df.columns), self.__input_df.dtypes)
+        copied = np.isin(batch_hashes, source_hashes)
+        accepted = []
+        for row, row_hash, is_copy in zip(rows, batch_hashes.tolist(), copied):
+            if is_copy or row_hash in seen_hashes:
+                continue
+            seen_hashes.add(row_hash)
+            accepted.append(row)
+        return accepted
+
     def generate_synthetic_data(self):
         n_remaining_rows = self.__n_synthetic_rows
-        generated_rows = []
+        # Source rows are kept as one sorted uint64 hash array (8 bytes a row); only generated rows go in a set
+        source_hashes = np.empty(0, dtype=np.uint64)
+        if self.__reject_duplicates:
+            source_hashes = self.__source_hashes
+            if source_hashes is None:
+                source_hashes = np.unique(row_hashes(self.__input_df, self.__input_df.dtypes))
+        seen_hashes = set()
+        # Rows go straight into typed column arrays instead of a list of Python lists
+        builder = ColumnarRowBuilder(self.__input_df.columns, dtypes=self.__input_df.dtypes)
+        empty_calls = 0
         while n_remaining_rows > 0:
-            for row in self.generate_rows(min(n_remaining_rows, self.__bucket_size)):
-                generated_rows.append(row)
-            n_remaining_rows = n_remaining_rows - self.__bucket_size
-            print(f'Generated {self.__n_synthetic_rows - n_remaining_rows} rows out of {self.__n_synthetic_rows} rows')
+            # Over-ask by the expected loss so each bucket usually comes back full in one call
+            n_wanted = min(n_remaining_rows, self.__bucket_size)
+            n_requested = min(math.ceil(n_wanted / self.__acceptance_tracker.rate()), 2 * n_wanted)
+
+            rows = self.generate_rows(n_requested)
+            accepted = self.__accept_rows(rows, source_hashes, seen_hashes)
+            self.__acceptance_tracker.record(n_requested, len(accepted))
+
+            if not accepted:
+                empty_calls += 1
+                if empty_calls > 6:
+                    raise SystemExit("Stuck in loop. Please run again.")
+                continue
+            empty_calls = 0
 
-        self.generated_df = pd.DataFrame(generated_rows, columns=self.__input_df.columns)
+            # Surplus rows are cut so the target is hit exactly; only accepted rows count as done
+            accepted = accepted[:n_remaining_rows]
+            builder.append_rows(accepted)
+            if self.__sink is not None:
+                builder.flush(self.__sink.write_batch)
+            n_remaining_rows = n_remaining_rows - len(accepted)
+            print(f'Generated {self.__n_synthetic_rows - n_remaining_rows} rows out of {self.__n_synthetic_rows} rows '
+                  f'(acceptance rate {self.__acceptance_tracker.rate():.2f})')
 
+        self.__acceptance_tracker.save()
+        self.generated_df = builder.to_frame()
 
-def save_dataframe_to_excel(df):
+
+class ColumnPartitionedGenerator:
+    def __init__(self, input_df, n_synthetic_rows = 2, custom_prompt = '', bucket_size = 5, n_workers = 2,
+                 anchor_columns = None, n_anchor_columns = 3, group_token_budget = 300, models = None):
+        self.__input_df = input_df
+        self.__n_synthetic_rows = max(2, n_synthetic_rows)
+        self.__custom_prompt = custom_prompt
+        self.__bucket_size = bucket_size
+        self.__n_workers = n_workers
+        self.__group_token_budget = group_token_budget
+        self.__anchor_columns = anchor_columns or self.__pick_anchor_columns(n_anchor_columns)
+
+        # gpt4all models are not safe to share between threads, so every worker checks out its own.
+        # The weights are memory-mapped, so the extra instances mostly cost KV cache, not another copy of the file.
+        # Each instance gets its share of the CPU threads; N instances at the full count would just contend for cores.
+        n_threads = threads_per_worker(n_workers)
+        self.__threads_per_worker = n_threads
+        self.__models = queue.Queue()
+        for model in (models or [])[:n_workers]:
+            self.__models.put(set_thread_count(resolve_model(model), n_threads))
+        for _ in range(n_workers - self.__models.qsize()):
+            self.__models.put(load_model(n_threads=n_threads))
+
+        self.__base_prompt = '''
+You are a synthetic data generator. You will be given some columns of a dataset and a few example rows. New rows have already been started: each one has a row key and values for some anchor columns. Fill in the remaining columns for every started row so that the values are consistent with its anchor values.
+
+I'll provide the example rows as a list of lists, one inner list per row, in the order of the column names.
+Then I'll provide the started rows as a list of lists. Each inner list starts with the row key, followed by the anchor values.
+
+Make sure that your output is generated as a json list of lists. Each inner list must start with the row key, followed by the values of the columns to fill in, in the order given. Make sure that the output json is clearly marked.
+        '''
+
+        self.generated_df = None
+
+    # Dates and low-cardinality columns tend to drive the values of the others, so they make good anchors
+    def __pick_anchor_columns(self, n_anchor_columns):
+        date_columns = [col for col in self.__input_df.columns if pd.api.types.is_datetime64_any_dtype(self.__input_df[col])]
+        other_columns = [col for col in self.__input_df.columns if col not in date_columns]
+        other_columns.sort(key=lambda col: self.__input_df[col].nunique())
+        return (date_columns + other_columns)[:n_anchor_columns]
+
+    # Splits the non-anchor columns into groups of adjacent columns that fit the per-row token budget
+    def __group_columns(self):
+        groups = []
+        group = []
+        group_tokens = 0
+        example = self.__input_df.iloc[0] if not self.__input_df.empty else None
+        for col in self.__input_df.columns:
+            if col in self.__anchor_columns:
+                continue
+            col_tokens = (len(str(col)) + (len(str(example[col])) if example is not None else 0)) // 4 + 1
+            if group and group_tokens + col_tokens > self.__group_token_budget:
+                groups.append(group)
+                group = []
+                group_tokens = 0
+            group.append(col)
+            group_tokens += col_tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    def __generate_skeleton(self):
+        model = self.__models.get()
+        # The skeleton runs alone, so its model may use every worker's threads until the groups start
+        set_thread_count(model, self.__threads_per_worker * self.__n_workers)
+        try:
+            anchor_generator = SyntheticDataGenerator(
+                self.__input_df[self.__anchor_columns],
+                n_synthetic_rows=self.__n_synthetic_rows,
+                custom_prompt=self.__custom_prompt,
+                bucket_size=self.__bucket_size,
+                model=model,
+                # A repeated anchor tuple is a legitimate skeleton row; the filled-in columns make rows distinct
+                reject_duplicates=False,
+                acceptance_tracker=AcceptanceTracker("skeleton", path=None),
+            )
+            anchor_generator.generate_synthetic_data()
+        finally:
+            set_thread_count(model, self.__threads_per_worker)
+            self.__models.put(model)
+
+        skeleton = anchor_generator.generated_df.head(self.__n_synthetic_rows).reset_index(drop=True)
+        skeleton.insert(0, "__row_key", range(len(skeleton)))
+        return skeleton
+
+    def __fill_group(self, group, skeleton_rows):
+        # The model sometimes skips started rows, so ask again for just the missing keys
+        filled = {}
+        pending_rows = skeleton_rows
+        iterations = 0
+        while pending_rows:
+            if iterations > 6:
+                raise SystemExit("Stuck in loop. Please run again.")
+            filled.update(self.__request_group(group, pending_rows))
+            pending_rows = [row for row in skeleton_rows if row[0] not in filled]
+            iterations += 1
+        return pd.DataFrame([[key] + values for key, values in filled.items()], columns=["__row_key"] + group)
+
+    def __request_group(self, group, skeleton_rows):
+        columns = self.__anchor_columns + group
+        examples = self.__input_df[columns].sample(min(len(skeleton_rows), len(self.__input_df)))
+        expected_keys = {row[0] for row in skeleton_rows}
+
+        prompt = self.__base_prompt + f'\nColumn Names: {json.dumps(columns, indent=4, default=str)}\n'
+        prompt = prompt + f'Example Rows: {json.dumps(examples.values.tolist(), indent=4, default=str)}\n'
+        prompt = prompt + f'Anchor Columns: {json.dumps(self.__anchor_columns, default=str)}\n'
+        prompt = prompt + f'Started Rows: {json.dumps(skeleton_rows, indent=4, default=str)}\n'
+        prompt = prompt + '\n' + self.__custom_prompt
+        prompt = prompt + '\n' + f'Please fill in these columns, in this order: {json.dumps(group, default=str)}'
+
+        model = self.__models.get()
+        try:
+            data = None
+            with model.chat_session():
+                iterations = 0
+                while data is None:
+                    if iterations > 6:
+                        raise SystemExit("Stuck in loop. Please run again.")
+                    response = model.generate(prompt, max_tokens = len(skeleton_rows) * 1024)
+                    data = parse_generated_rows(response)
+                    iterations += 1
+        finally:
+            self.__models.put(model)
+
+        # Keep only rows for keys we asked about, padding or trimming each to the group width
+        filled = {}
+        for row in data:
+            try:
+                key = int(row[0])
+            except (IndexError, TypeError, ValueError):
+                continue
+            if key in expected_keys:
+                values = list(row[1:len(group) + 1])
+                filled[key] = values + [None] * (len(group) - len(values))
+        return filled
+
+    def generate_synthetic_data(self):
+        skeleton = self.__generate_skeleton()
+        groups = self.__group_columns()
+        print(f'Generated skeleton of {len(skeleton)} rows; filling {len(groups)} column groups with {self.__n_workers} workers')
+
+        skeleton_values = json.loads(skeleton.to_json(orient="values", date_format="iso"))
+        buckets = [skeleton_values[i:i + self.__bucket_size] for i in range(0, len(skeleton_values), self.__bucket_size)]
+
+        with ThreadPoolExecutor(max_workers=self.__n_workers) as executor:
+            futures = [(group, executor.submit(self.__fill_group, group, bucket)) for group in groups for bucket in buckets]
+            group_parts = {}
+            for group, future in futures:
+                group_parts.setdefault(tuple(group), []).append(future.result())
+
+        generated_df = skeleton
+        for parts in group_parts.values():
+            generated_df = generated_df.merge(pd.concat(parts, ignore_index=True), on="__row_key", how="left")
+
+        self.generated_df = generated_df[self.__input_df.columns]
+
+
+def save_dataframe_to_excel(df, output_dir="."):
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    filename = f"synthetic_data_{timestamp}.xlsx"
+    filename = os.path.join(output_dir, f"synthetic_data_{timestamp}.xlsx")
     df.to_excel(filename, index=False)
     return filename
 
 
 def main():
-    input_df = pd.read_excel("Dataset.xlsx", sheet_name="Sheet1")
-
-    processor = DataPreprocessor()
-    condensed_df = processor.preprocess_data(input_df)
-
-    synthetic_data_generator = SyntheticDataGenerator(input_df=condensed_df, n_synthetic_rows=10, bucket_size = 5)
-    synthetic_data_generator.generate_synthetic_data()
+    parser = argparse.ArgumentParser(description="Condense a workbook and generate synthetic rows from it.")
+    parser.add_argument("--input", default="Dataset.xlsx")
+    parser.add_argument("--sheet", default="Sheet1")
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--bucket-size", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=max(1, min(4, (os.cpu_count() or 1) // 4)),
+                        help="Model instances filling column groups in parallel; CPU threads are split between them")
+    parser.add_argument("--database-url", help="Postgres connection string; generated rows are also copied into --table")
+    parser.add_argument("--table", default="synthetic_data")
+    parser.add_argument("--partition-columns", type=int, default=40,
+                        help="Generate column groups in parallel when more columns than this are kept")
+    args = parser.parse_args()
+
+    # Start loading the weights now; they are only needed once the sample has been read
+    model_future = load_model_async()
+
+    # One streaming pass gives the sample rows; the full sheet is only read for the kept columns
+    reader = DatasetReader(args.input, sheet_name=args.sheet, sample_size=10)
+    sample_df = reader.scan()
+
+    model = model_future.result()
+    processor = DataPreprocessor(model=model)
+    condensed_df = reader.read_columns(processor.select_columns(sample_df))
+
+    # The table schema follows the source columns, not whatever types the model's first batch happened to use
+    sink = PostgresCopySink(args.database_url, args.table, infer_schema(condensed_df)) if args.database_url else None
+    try:
+        if len(condensed_df.columns) > args.partition_columns:
+            synthetic_data_generator = ColumnPartitionedGenerator(input_df=condensed_df, n_synthetic_rows=args.rows, bucket_size = args.bucket_size,
+                                                                  n_workers=args.workers, models=[model])
+            synthetic_data_generator.generate_synthetic_data()
+            # Column groups are only complete once joined, so the partitioned rows are copied in one go
+            if sink is not None:
+                sink.write_batch(synthetic_data_generator.generated_df)
+        else:
+            synthetic_data_generator = SyntheticDataGenerator(input_df=condensed_df, n_synthetic_rows=args.rows, bucket_size = args.bucket_size,
+                                                              model=model, sink=sink)
+            synthetic_data_generator.generate_synthetic_data()
+    finally:
+        if sink is not None:
+            sink.close()
 
     synthetic_df = synthetic_data_generator.generated_df
     save_dataframe_to_excel(synthetic_df)
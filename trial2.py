@@ -1,13 +1,13 @@
 import pandas as pd
-from gpt4all import GPT4All
 import json
 import re
 from openpyxl import load_workbook
+from data_loader import DatasetReader
+from model_loader import load_model_async
 
-model = GPT4All(model_name='Meta-Llama-3-8B-Instruct.Q4_0.gguf', model_path='./', allow_download=False, n_ctx=8192)
-
-def read_excel(file_path):
-    return pd.read_excel(file_path)
+def read_excel(file_path, sheet_name="Sheet1", sample_size=10):
+    """ Streams the sheet once and returns a uniform sample of sample_size rows; the prompt never needs more. """
+    return DatasetReader(file_path, sheet_name=sheet_name, sample_size=sample_size).scan()
 
 def prepare_prompt(df, num_samples=5, num_rows_to_generate=10):
     columns = df.columns.tolist()
@@ -39,7 +39,7 @@ def extract_json(response):
         print(f"Error extracting JSON: {e}")
         return None
 
-def generate_synthetic_data(df, num_samples=2, num_rows=10):
+def generate_synthetic_data(model, df, num_samples=2, num_rows=10):
     if num_rows < 2:
         num_rows = 2
 
@@ -74,11 +74,14 @@ def append_to_excel(file_path, sheet_name, df):
 
 def main():
     file_path = "Dataset.xlsx"
-    df = read_excel(file_path)
+
+    # Load the model in the background instead of at import time, overlapping it with the Excel read
+    model_future = load_model_async()
+    df = read_excel(file_path, sample_size=8)
 
     ## Iss line pe num_samples is ki kitne datapoints uthayenge original dataset se
     ## And num_rows is kitne synthetic datapoints generate krenge
-    synthetic_df = generate_synthetic_data(df, num_samples=8, num_rows=8)
+    synthetic_df = generate_synthetic_data(model_future.result(), df, num_samples=8, num_rows=8)
 
     if synthetic_df is not None:
         print("Synthetic DataFrame:")
@@ -0,0 +1,95 @@
+import argparse
+import os
+import time
+from model_loader import MODEL_NAME, MODEL_PATH, N_CTX, load_model, save_inference_profile
+
+# Roughly the shape of a generation call: a long prompt of sample rows, then a few hundred tokens of output
+CALIBRATION_ROW = '["2024-03-14", "Wire transfer to supplier", 15230.75, "USD", "Settled"]'
+CALIBRATION_PROMPT = (
+    "You are a synthetic data generator. Here are some rows of a dataset:\n"
+    + "\n".join([CALIBRATION_ROW] * 40)
+    + "\nPlease generate 5 new rows in the same format."
+)
+
+
+def measure(model, n_batch, max_tokens):
+    """ Times one generation, splitting it into prompt evaluation (until the first token) and decoding. """
+    start = time.perf_counter()
+    first_token_at = None
+    n_generated = 0
+    with model.chat_session():
+        for _ in model.generate(CALIBRATION_PROMPT, max_tokens=max_tokens, n_batch=n_batch, streaming=True):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            n_generated += 1
+    end = time.perf_counter()
+
+    if first_token_at is None:
+        first_token_at = end
+    # gpt4all does not expose its tokenizer, so use the same chars / 4 estimate as the rest of the pipeline
+    prompt_tokens = len(CALIBRATION_PROMPT) // 4
+    prompt_seconds = first_token_at - start
+    decode_seconds = end - first_token_at
+    return {
+        "prompt_tokens_per_sec": prompt_tokens / prompt_seconds if prompt_seconds > 0 else 0.0,
+        "decode_tokens_per_sec": (n_generated - 1) / decode_seconds if decode_seconds > 0 and n_generated > 1 else 0.0,
+        "seconds": end - start,
+    }
+
+
+def main():
+    cpu_count = os.cpu_count() or 4
+    default_threads = sorted({max(1, cpu_count // 4), max(1, cpu_count // 2), cpu_count})
+
+    parser = argparse.ArgumentParser(description="Measure inference speed for the GGUF model and store the fastest settings for this host.")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--threads", type=int, nargs="+", default=default_threads)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 128, 512])
+    parser.add_argument("--contexts", type=int, nargs="+", default=[N_CTX])
+    parser.add_argument("--min-ctx", type=int, default=N_CTX,
+                        help="Smallest context the pipeline loads with; load_model never goes below it, so smaller ones aren't tuned")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    # load_model uses max(caller's n_ctx, profile n_ctx), so a smaller tuned context would never be used
+    # and the threads and batch size measured with it would be applied to a context they weren't measured for
+    contexts = [n_ctx for n_ctx in args.contexts if n_ctx >= args.min_ctx]
+    if not contexts:
+        parser.error(f"no context in --contexts is at least --min-ctx {args.min_ctx}")
+    for n_ctx in sorted(set(args.contexts) - set(contexts)):
+        print(f"Skipping n_ctx={n_ctx}: below --min-ctx {args.min_ctx}")
+
+    results = []
+    for n_ctx in contexts:
+        for n_threads in args.threads:
+            # Threads and context are fixed when the model is created; batch size is per call
+            model = load_model(args.model, args.model_path, n_ctx=n_ctx, n_threads=n_threads, apply_profile=False)
+            measure(model, args.batch_sizes[0], 1)  # Warm-up, so page faults on the weights don't count against the first setting
+            for n_batch in args.batch_sizes:
+                result = measure(model, n_batch, args.max_tokens)
+                result.update({"n_ctx": n_ctx, "n_threads": n_threads, "n_batch": n_batch})
+                results.append(result)
+                print(f"n_ctx={n_ctx:>6} n_threads={n_threads:>3} n_batch={n_batch:>4}  "
+                      f"prompt {result['prompt_tokens_per_sec']:8.1f} tok/s  decode {result['decode_tokens_per_sec']:6.1f} tok/s  "
+                      f"total {result['seconds']:6.2f}s")
+            del model
+
+    # Runs can stop early on EOS, so rank by the measured rates at a fixed workload rather than by wall-clock time
+    prompt_tokens = len(CALIBRATION_PROMPT) // 4
+
+    def estimated_seconds(result):
+        if result["prompt_tokens_per_sec"] <= 0 or result["decode_tokens_per_sec"] <= 0:
+            return float("inf")
+        return prompt_tokens / result["prompt_tokens_per_sec"] + args.max_tokens / result["decode_tokens_per_sec"]
+
+    best = min(results, key=estimated_seconds)
+    path = save_inference_profile(args.model, best, model_path=args.model_path)
+    print(f"\nBest: n_ctx={best['n_ctx']} n_threads={best['n_threads']} n_batch={best['n_batch']} "
+          f"(prompt {best['prompt_tokens_per_sec']:.1f} tok/s, decode {best['decode_tokens_per_sec']:.1f} tok/s, "
+          f"estimated {estimated_seconds(best):.2f}s per call)")
+    print(f"Profile saved to {path}")
+
+
+if __name__ == '__main__':
+    main()